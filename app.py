@@ -5,15 +5,21 @@
 
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import numpy as np
 import matplotlib.pyplot as plt
-import seaborn as sns
+from matplotlib.figure import Figure
+import altair as alt
+from numba import njit
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from uuid import uuid4
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import (
-    SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
+    SimpleDocTemplate, Paragraph, Spacer, Image, LongTable, TableStyle
 )
 from reportlab.lib.styles import getSampleStyleSheet
 import os
@@ -22,6 +28,7 @@ import os
 # CONFIGURATION
 # ==========================================================
 st.set_page_config(page_title="H-DATA – AI Data Doctor", page_icon="🧠", layout="wide")
+plt.rcParams["figure.dpi"] = 80
 
 st.markdown("""
 <style>
@@ -43,20 +50,85 @@ st.title("🧠 H-DATA – AI Data Doctor")
 st.markdown("_Analyse. Corrige. Visualise._")
 st.markdown("**Développé par HAMDINOU Moulaye Driss © 2025**")
 
+# ==========================================================
+# NOYAUX NUMÉRIQUES
+# ==========================================================
+@njit(cache=True)
+def outlier_counts(arr2d):
+    n_rows, n_cols = arr2d.shape
+    counts = np.zeros(n_cols, dtype=np.int64)
+    for j in range(n_cols):
+        # Moyenne et écart-type (ddof=1) en une passe, NaN ignorés comme pandas
+        n, mean, m2 = 0, 0.0, 0.0
+        for i in range(n_rows):
+            x = arr2d[i, j]
+            if not np.isnan(x):
+                n += 1
+                delta = x - mean
+                mean += delta / n
+                m2 += delta * (x - mean)
+        if n > 1:
+            threshold = 3 * np.sqrt(m2 / (n - 1))
+            c = 0
+            for i in range(n_rows):
+                if abs(arr2d[i, j] - mean) > threshold:
+                    c += 1
+            counts[j] = c
+    return counts
+
 # ==========================================================
 # UPLOAD DES DONNÉES
 # ==========================================================
 st.header("📂 Importation des données")
 
+def read_upload(file_bytes, name, max_rows=0):
+    if name.endswith(".csv"):
+        if max_rows:
+            # Le moteur C s'arrête après max_rows lignes sans lire le reste du fichier
+            return pd.read_csv(BytesIO(file_bytes), nrows=max_rows)
+        try:
+            return pd.read_csv(BytesIO(file_bytes), engine="pyarrow")
+        except (ImportError, ValueError):
+            return pd.read_csv(BytesIO(file_bytes))
+    try:
+        return pd.read_excel(BytesIO(file_bytes), engine="calamine", nrows=max_rows or None)
+    except (ImportError, ValueError):
+        return pd.read_excel(BytesIO(file_bytes), engine="openpyxl", nrows=max_rows or None)
+
+def optimize_dtypes(df):
+    for c in df.select_dtypes("integer"):
+        df[c] = pd.to_numeric(df[c], downcast="integer")
+    for c in df.select_dtypes("float"):
+        # float32 seulement si aucune valeur ne change : l'export doit rester fidèle au fichier
+        s32 = df[c].astype("float32")
+        if ((s32.astype("float64") == df[c]) | df[c].isna()).all():
+            df[c] = s32
+    # pandas 3 stocke le texte en dtype "str" et non plus "object"
+    for c in df.select_dtypes(include=["object", "string"]):
+        if len(df) and df[c].nunique() / len(df) < 0.5:
+            df[c] = df[c].astype("category")
+        elif df[c].dtype == object and pd.api.types.infer_dtype(df[c], skipna=True) == "string":
+            df[c] = df[c].astype("string[pyarrow]")
+    return df
+
+@st.cache_data(show_spinner=False)
+def load_df(file_bytes, name, max_rows=0):
+    df = optimize_dtypes(read_upload(file_bytes, name, max_rows))
+    return df, df.memory_usage(deep=True).sum()
+
+max_rows = st.sidebar.number_input(
+    "Nombre maximal de lignes à charger (0 = tout le fichier) :",
+    min_value=0, value=0, step=100_000
+)
+
 uploaded_file = st.file_uploader("Importez un fichier CSV ou Excel :", type=["csv", "xlsx"])
 
 if uploaded_file is not None:
+    raw = uploaded_file.getvalue()
     try:
-        if uploaded_file.name.endswith(".csv"):
-            df = pd.read_csv(uploaded_file)
-        else:
-            df = pd.read_excel(uploaded_file)
+        df, memory_bytes = load_df(raw, uploaded_file.name, max_rows)
         st.success(f"✅ Fichier chargé avec succès : {uploaded_file.name}")
+        st.caption(f"Mémoire occupée : {memory_bytes / 1e6:.1f} Mo")
         st.dataframe(df.head())
     except Exception as e:
         st.error(f"Erreur lors du chargement du fichier : {e}")
@@ -67,19 +139,45 @@ if uploaded_file is not None:
     # ==========================================================
     st.header("🤖 Diagnostic intelligent des données")
 
+    PROPOSITIONS = {
+        "Valeurs manquantes": "Remplacer par moyenne/médiane",
+        "Valeurs aberrantes": "Remplacer par médiane",
+        "Doublons": "Supprimer doublons",
+    }
+
+    def null_counts(df):
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except pa.ArrowException:
+            # Colonnes à types mixtes : Arrow ne sait pas les convertir
+            return df.isnull().sum()
+        # null_count est tenu à jour dans les bitmaps de validité (NaN convertis en null)
+        return pd.Series([col.null_count for col in table.columns], index=df.columns)
+
+    @st.cache_data(show_spinner=False)
     def analyse_data(df):
-        diag = []
-        for col in df.columns:
-            if df[col].isnull().sum() > 0:
-                diag.append((col, "Valeurs manquantes", df[col].isnull().sum(), "Remplacer par moyenne/médiane"))
-            if df[col].dtype in [np.float64, np.int64]:
-                outliers = ((df[col] - df[col].mean()).abs() > 3 * df[col].std()).sum()
-                if outliers > 0:
-                    diag.append((col, "Valeurs aberrantes", outliers, "Remplacer par médiane"))
-            if df[col].duplicated().any():
-                diag.append((col, "Doublons", df[col].duplicated().sum(), "Supprimer doublons"))
-        return pd.DataFrame(diag, columns=["Colonne", "Problème", "Nb Occurrences", "Proposition IA"])
+        num = df.select_dtypes(include=np.number)
+        counts = pd.DataFrame({
+            "Valeurs manquantes": null_counts(df),
+            "Valeurs aberrantes": pd.Series(
+                outlier_counts(np.asfortranarray(num.to_numpy(dtype=np.float64, na_value=np.nan))),
+                index=num.columns,
+            ),
+            "Doublons": len(df) - df.nunique(dropna=False),
+        }, index=df.columns).fillna(0).astype(int)
+
+        # Parcours ligne par ligne : une colonne garde ses problèmes dans l'ordre ci-dessus
+        values = counts.to_numpy()
+        mask = values > 0
+        cols, probs = np.nonzero(mask)
+        return pd.DataFrame({
+            "Colonne": counts.index[cols],
+            "Problème": counts.columns[probs],
+            "Nb Occurrences": values[mask],
+            "Proposition IA": counts.columns[probs].map(PROPOSITIONS),
+        })
 
+    num_cols = df.select_dtypes(include=np.number).columns
     diag_df = analyse_data(df)
     st.dataframe(diag_df)
 
@@ -89,45 +187,129 @@ if uploaded_file is not None:
     st.header("🧹 Application des corrections IA")
 
     if st.checkbox("✅ Appliquer automatiquement les corrections suggérées"):
-        for _, row in diag_df.iterrows():
-            col = row["Colonne"]
-            if "manquantes" in row["Problème"]:
-                if df[col].dtype in [np.float64, np.int64]:
-                    df[col].fillna(df[col].median(), inplace=True)
-            if "aberrantes" in row["Problème"]:
-                mean, std = df[col].mean(), df[col].std()
-                df[col] = np.where((df[col] - mean).abs() > 3*std, df[col].median(), df[col])
-            if "Doublons" in row["Problème"]:
-                df.drop_duplicates(subset=[col], inplace=True)
+        cols_par_probleme = diag_df.groupby("Problème")["Colonne"].agg(list)
+        missing_cols = [c for c in cols_par_probleme.get("Valeurs manquantes", []) if c in num_cols]
+        outlier_cols = cols_par_probleme.get("Valeurs aberrantes", [])
+        dup_cols = cols_par_probleme.get("Doublons", [])
+
+        if missing_cols:
+            df[missing_cols] = df[missing_cols].fillna(df[missing_cols].median())
+        if outlier_cols:
+            sub = df[outlier_cols]
+            df[outlier_cols] = sub.mask((sub - sub.mean()).abs() > 3 * sub.std(), sub.median(), axis=1)
+        if dup_cols:
+            df = df.drop_duplicates(subset=dup_cols)
         st.success("✅ Corrections appliquées automatiquement avec succès.")
         st.dataframe(df.head())
 
+    @st.cache_resource
+    def get_executor():
+        return ThreadPoolExecutor(max_workers=3)
+
+    def write_atomic(write, path):
+        # Fichier temporaire puis renommage : aucun lecteur ne voit un export à moitié écrit
+        tmp_path = f"{path}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    def export_data(df, cleaned_path):
+        # Le CSV reste écrit par pandas pour garder le format habituel ; Arrow sert à la copie Parquet
+        write_atomic(lambda path: df.to_csv(path, index=False), cleaned_path)
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except pa.ArrowException:
+            # Colonnes non convertibles par Arrow : pas de copie Parquet
+            return None
+        parquet_path = cleaned_path.replace(".csv", ".parquet")
+        write_atomic(lambda path: pq.write_table(table, path, compression="zstd"), parquet_path)
+        return parquet_path
+
+    # L'écriture disque de l'export se fait en arrière-plan pendant le rendu des graphiques.
+    # Un rerun interrompt le script mais pas l'export déjà soumis : on annule celui de la
+    # session s'il attend encore, et chaque soumission écrit dans son propre fichier.
+    previous_export = st.session_state.get("export_future")
+    if previous_export is not None:
+        previous_export.cancel()
+    os.makedirs("outputs", exist_ok=True)
+    cleaned_path = f"outputs/data_cleaned_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid4().hex[:8]}.csv"
+    export_future = get_executor().submit(export_data, df, cleaned_path)
+    st.session_state["export_future"] = export_future
+
     # ==========================================================
     # VISUALISATIONS RAPIDES
     # ==========================================================
     st.header("📊 Visualisations rapides")
 
-    col_choice = st.selectbox("Choisir une colonne numérique :", df.select_dtypes(include=np.number).columns)
+    KDE_SAMPLE_SIZE = 10_000
+
+    @st.cache_data(show_spinner=False)
+    def compute_corr(num_df):
+        block = num_df.to_numpy(dtype=np.float64, na_value=np.nan)
+        if np.isnan(block).any():
+            # Seul pandas sait exclure les NaN paire par paire
+            return num_df.corr()
+        corr = np.atleast_2d(np.corrcoef(block, rowvar=False))
+        return pd.DataFrame(corr, index=num_df.columns, columns=num_df.columns)
+
+    # Les octets PNG sont mis en cache, pas la Figure : matplotlib n'est pas thread-safe
+    # et une Figure partagée serait redessinée en parallèle par plusieurs sessions
+    @st.cache_data(show_spinner=False, max_entries=16)
+    def heatmap_png(corr):
+        fig = Figure(figsize=(6, 4))
+        ax = fig.subplots()
+        # Un seul QuadMesh au lieu d'un rectangle par cellule
+        mesh = ax.pcolormesh(corr.to_numpy(), cmap="Blues", shading="nearest")
+        fig.colorbar(mesh, ax=ax)
+        labels = [str(c) for c in corr.columns]
+        ax.set_xticks(range(len(labels)), labels, rotation=90)
+        ax.set_yticks(range(len(labels)), labels)
+        ax.invert_yaxis()
+        ax.set_title("Heatmap de corrélation")
+        buffer = BytesIO()
+        fig.savefig(buffer, format="png", bbox_inches="tight")
+        return buffer.getvalue()
+
+    def histogram_chart(values, title, kde=False):
+        counts, edges = np.histogram(values, bins=30)
+        hist = pd.DataFrame({"début": edges[:-1], "fin": edges[1:], "effectif": counts})
+        chart = alt.Chart(hist).mark_bar(color="#0078D7").encode(
+            x=alt.X("début:Q", title=None), x2="fin:Q", y=alt.Y("effectif:Q", title="Effectif")
+        )
+        if kde and len(values) > 1:
+            # KDE gaussienne (règle de Scott) sur un sous-échantillon, ramenée à l'échelle des effectifs
+            sample = values
+            if len(values) > KDE_SAMPLE_SIZE:
+                sample = np.random.default_rng(0).choice(values, KDE_SAMPLE_SIZE, replace=False)
+            bw = sample.std(ddof=1) * len(sample) ** (-1 / 5)
+            if bw > 0:
+                grid = np.linspace(edges[0], edges[-1], 200)
+                density = np.exp(-0.5 * ((grid[:, None] - sample[None, :]) / bw) ** 2).sum(axis=1)
+                density /= len(sample) * bw * np.sqrt(2 * np.pi)
+                curve = pd.DataFrame({"x": grid, "effectif": density * len(values) * (edges[1] - edges[0])})
+                chart += alt.Chart(curve).mark_line(color="#00C853").encode(x="x:Q", y="effectif:Q")
+        return chart.properties(title=title)
+
+    # Les corrections ne changent pas les types : la liste des colonnes numériques reste valable
+    num_df = df[num_cols]
+    col_choice = st.selectbox("Choisir une colonne numérique :", num_cols)
     if col_choice:
-        fig, ax = plt.subplots(figsize=(6, 3))
-        sns.histplot(df[col_choice], bins=30, kde=True, ax=ax, color="#0078D7")
-        ax.set_title(f"Distribution de {col_choice}")
-        st.pyplot(fig)
+        show_kde = st.checkbox("Afficher la densité (KDE)")
+        values = num_df[col_choice].dropna().to_numpy(dtype=np.float64)
+        st.altair_chart(
+            histogram_chart(values, f"Distribution de {col_choice}", kde=show_kde),
+            width="stretch"
+        )
 
-        corr = df.select_dtypes(include=np.number).corr()
-        fig2, ax2 = plt.subplots(figsize=(6, 4))
-        sns.heatmap(corr, cmap="Blues", ax=ax2)
-        ax2.set_title("Heatmap de corrélation")
-        st.pyplot(fig2)
+        st.image(heatmap_png(compute_corr(num_df)))
 
     # ==========================================================
     # EXPORT CSV
     # ==========================================================
     st.header("💾 Export des données nettoyées")
-    os.makedirs("outputs", exist_ok=True)
-    cleaned_path = f"outputs/data_cleaned_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    df.to_csv(cleaned_path, index=False)
+    parquet_path = export_future.result()
     st.success(f"✅ Données sauvegardées : {cleaned_path}")
+    if parquet_path:
+        st.caption(f"Copie Parquet : {parquet_path}")
 
     # ==========================================================
     # GÉNÉRATION DU RAPPORT PDF
@@ -142,7 +324,7 @@ if uploaded_file is not None:
 
     if st.button("📄 Générer le rapport PDF"):
         buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4)
+        doc = SimpleDocTemplate(buffer, pagesize=A4, pageCompression=1)
         styles = getSampleStyleSheet()
         story = []
 
@@ -165,7 +347,8 @@ if uploaded_file is not None:
         if "Diagnostic IA" in sections:
             story.append(Paragraph("<b>Diagnostic IA :</b>", styles["Heading2"]))
             table_data = [diag_df.columns.tolist()] + diag_df.values.tolist()
-            table = Table(table_data)
+            # LongTable découpe le tableau page par page et répète l'en-tête
+            table = LongTable(table_data, repeatRows=1)
             table.setStyle(TableStyle([
                 ("GRID", (0, 0), (-1, -1), 1, colors.black),
                 ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#0078D7")),
@@ -179,10 +362,9 @@ if uploaded_file is not None:
         doc.build(story)
         buffer.seek(0)
 
-        pdf_bytes = buffer.getvalue()
         st.download_button(
             label="📥 Télécharger le rapport PDF",
-            data=pdf_bytes,
+            data=buffer,
             file_name="rapport_hdata.pdf",
             mime="application/pdf"
         )